@@ -50,35 +50,12 @@ logger.debug("Using config:\n%s", json.dumps(config, sort_keys=True, indent=4))
 ############################################################
 
 def remove_hidden():
-    hidden = 0
-    deleted = 0
     logger.debug("Checking %r", config['unionfs_folder'])
-    for path, subdirs, files in os.walk(config['unionfs_folder']):
-        for name in files:
-            file = os.path.join(path, name)
-            if file and file.endswith('_HIDDEN~'):
-                hidden += 1
-                logger.debug("Hidden file found: %r", file)
-                cloud_path = file.replace(config['unionfs_folder'], config['cloud_folder']).rstrip('_HIDDEN~')
-                remote_path = file.replace(config['unionfs_folder'], config['remote_folder']).rstrip('_HIDDEN~')
-                if os.path.exists(cloud_path):
-                    logger.debug("Removing %r", remote_path)
-                    if utils.rclone_delete(remote_path, config['dry_run']):
-                        deleted += 1
-                        logger.debug("Deleted %r", remote_path)
-                        if not config['dry_run']:
-                            try:
-                                os.remove(file)
-                            except Exception as ex:
-                                logger.exception("Exception removing _HIDDEN~ file %s: ", file)
-                    else:
-                        logger.debug("Failed to delete %r", remote_path)
-                else:
-                    logger.debug("File does not exist on remote, removing %r", file)
-                    if not config['dry_run']:
-                        os.remove(file)
-
-    logger.debug("Found %d hidden file(s), deleted %d file(s) off remote", hidden, deleted)
+    remote_deletes, hidden_removals = utils.scan_hidden(config)
+    plan = {'remote_deletes': remote_deletes, 'hidden_removals': hidden_removals}
+    deleted, failed = utils.execute_hidden(plan, config, config['dry_run'])
+    logger.debug("Found %d hidden file(s), deleted %d file(s) off remote",
+                 len(remote_deletes) + len(hidden_removals), deleted)
 
 
 ############################################################
@@ -89,10 +66,19 @@ default_check_interval = 0
 
 def upload_manager():
     global config, default_check_interval
+    signal.signal(signal.SIGTERM, exit_draining)
     try:
         default_check_interval = config['local_folder_check_interval']
         logger.debug("Started upload manager for %r", config['local_folder'])
+
+        # finish off an upload that was interrupted by a restart before doing anything else
+        utils.resume_upload(config)
+        if utils.draining:
+            sys.exit(0)
+
         while True:
+            if utils.draining:
+                sys.exit(0)
             time.sleep(60 * config['local_folder_check_interval'])
 
             # restore check interval to original after an extended sleep after a rate limit ban (25hrs)
@@ -106,6 +92,11 @@ def upload_manager():
                                         "local_folder_check_interval has been reset back to %d minutes after a 25 hour "
                                         "sleep due to ratelimits!" % config['local_folder_check_interval'])
 
+            # resume an upload that was stopped early by rate limits or rclone errors
+            utils.resume_upload(config)
+            if utils.draining:
+                sys.exit(0)
+
             logger.debug("Checking size of %r", config['local_folder'])
             size = utils.folder_size(config['local_folder'], config['du_excludes'])
             if size is not None and size > 0:
@@ -136,21 +127,26 @@ def upload_manager():
 
                     # rclone move local_folder to local_remote
                     logger.debug("Moving data from %r to %r...", config['local_folder'], config['local_remote'])
-                    upload_cmd = utils.rclone_move_command(config['local_folder'], config['local_remote'],
-                                                           config['rclone_transfers'], config['rclone_checkers'],
-                                                           config['rclone_bwlimit'], config['rclone_excludes'],
-                                                           config['rclone_chunk_size'], config['dry_run'])
-                    logger.debug("Using: %r", upload_cmd)
+                    try:
+                        upload = utils.plan_upload(config)[0]
+                    except Exception as ex:
+                        logger.exception("Exception listing files to upload, skipping upload until next check: ")
+                        continue
 
                     start_time = timeit.default_timer()
-                    utils.run_command(upload_cmd, config)
+                    utils.execute_upload(upload, config, config['dry_run'])
                     time_taken = timeit.default_timer() - start_time
                     logger.debug("Moving finished in %s", utils.seconds_to_string(time_taken))
+                    if utils.draining:
+                        logger.debug("Upload was stopped early, the remainder will be resumed on the next start")
+                        sys.exit(0)
 
                     # remove empty directories
                     if len(config['rclone_remove_empty_on_upload']):
                         time.sleep(5)
                         utils.remove_empty_directories(config)
+                        if utils.draining:
+                            sys.exit(0)
 
                     new_size = utils.folder_size(config['local_folder'], config['du_excludes'])
                     logger.debug("Local folder is now left with %d gigabytes", new_size)
@@ -194,6 +190,7 @@ def config_monitor():
 # PROCESS STUFF
 ############################################################
 processes = []
+main_pid = os.getpid()
 
 
 def start(path):
@@ -204,14 +201,14 @@ def start(path):
         if config['use_upload_manager']:
             upload_process = Process(target=upload_manager)
             upload_process.start()
-            processes.append(upload_process.pid)
+            processes.append(upload_process)
 
         # start config manager
         config_process = None
         if config['use_config_manager']:
             config_process = Process(target=config_monitor)
             config_process.start()
-            processes.append(config_process.pid)
+            processes.append(config_process)
 
         # join and wait finish
         if config['use_upload_manager'] and upload_process is not None:
@@ -225,25 +222,54 @@ def start(path):
         logger.debug("Cannot start file monitor, %r is not a valid path.", path)
 
 
+def stop_processes():
+    # children get upload_drain_seconds to finish what they are doing before they are killed
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+
+    deadline = time.time() + config['upload_drain_seconds'] + 10
+    for process in processes:
+        process.join(max(0, deadline - time.time()))
+        if process.is_alive():
+            logger.debug("Process %r did not stop in time, killing it", process.pid)
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
+
 def exit_gracefully(signum, frame):
     logger.debug("Shutting down process %r", os.getpid())
+    if os.getpid() == main_pid:
+        stop_processes()
     sys.exit(0)
 
 
+def exit_draining(signum, frame):
+    if utils.drain_command(config['upload_drain_seconds']):
+        logger.debug("Draining upload before shutting down process %r", os.getpid())
+        return
+    exit_gracefully(signum, frame)
+
+
 def exit_restart(signum, frame):
-    for pid in processes:
-        if pid == os.getpid():
-            continue
-        os.kill(pid, signal.SIGTERM)
+    stop_processes()
     sys.exit(0)
 
 
 if __name__ == "__main__":
     if len(sys.argv):
-        for item in sys.argv:
+        for index, item in enumerate(sys.argv):
             if item == 'test':
                 utils.config_test(config)
                 exit(0)
+            if item == 'plan':
+                utils.write_plan(utils.build_plan(config), sys.argv[index + 1] if len(sys.argv) > index + 1 else None)
+                exit(0)
+            if item == 'execute':
+                if len(sys.argv) <= index + 1:
+                    logger.error("You must specify the plan file to execute, e.g. cleaner.py execute plan.json")
+                    exit(1)
+                exit(0 if utils.execute_plan(utils.load_plan(sys.argv[index + 1]), config) else 1)
             if item == 'rmdirs':
                 utils.remove_empty_directories(config)
                 exit(0)
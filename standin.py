@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+import fcntl
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+
+############################################################
+# INIT
+############################################################
+
+# rclone compatible stand-in for a remote, backed by a local folder. It understands the subset of rclone move and
+# rclone delete used by the cleaner and prints rclone style log lines, so uploads and purges can be run offline.
+# e.g. standin.py --root=/tmp/remote --latency=0.2 --rate-limit-every=50 move /mnt/local/Media google:/Media
+logging.basicConfig(format='%(asctime)s %(levelname)-5s : %(message)s', datefmt='%Y/%m/%d %H:%M:%S',
+                    stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+rate_limit_message = "googleapi: Error 403: User rate limit exceeded, userRateLimitExceeded"
+
+
+############################################################
+# STANDIN STUFF
+############################################################
+
+class Throttle(object):
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.sent = 0
+
+    def wait(self, size):
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            self.sent += size
+            delay = self.start + self.sent / self.bytes_per_second - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Standin(object):
+    def __init__(self, root, latency=0.0, bwlimit=None, rate_limit_every=0, dry_run=False):
+        self.root = root
+        self.latency = latency
+        self.throttle = Throttle(bwlimit)
+        self.rate_limit_every = rate_limit_every
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+
+    def path(self, remote):
+        # google:/Media/file.mkv -> root/Media/file.mkv
+        return os.path.join(self.root, remote.split(':', 1)[-1].lstrip('/'))
+
+    def count_request(self):
+        # the request count is kept under root, so every delete (one process each) counts towards rate limits
+        os.makedirs(self.root, exist_ok=True)
+        with self.lock, open(os.path.join(self.root, '.standin_requests'), 'a+') as fp:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            fp.seek(0)
+            requests = int(fp.read().strip() or 0) + 1
+            fp.seek(0)
+            fp.truncate()
+            fp.write(str(requests))
+            fp.close()
+        return requests
+
+    def request(self):
+        # every remote call costs a round trip and may be refused, like the drive api
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.rate_limit_every:
+            return True
+        return self.count_request() % self.rate_limit_every != 0
+
+    def copy(self, source, destination, name):
+        if not self.request():
+            logger.error("%s: Failed to copy: %s", name, rate_limit_message)
+            return False
+        if self.dry_run:
+            logger.info("%s: Not copying as --dry-run", name)
+            return False
+
+        # like rclone, an identical object already on the remote is not transferred again
+        if os.path.isfile(destination):
+            src, dst = os.stat(source), os.stat(destination)
+            if src.st_size == dst.st_size and int(src.st_mtime) == int(dst.st_mtime):
+                logger.debug("%s: Unchanged skipping", name)
+                return True
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(source, 'rb') as src, open(destination + '.partial', 'wb') as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                self.throttle.wait(len(chunk))
+                dst.write(chunk)
+        os.replace(destination + '.partial', destination)
+        shutil.copystat(source, destination)
+        logger.info("%s: Copied (new)", name)
+        return True
+
+    def move(self, source, remote, files, transfers):
+        destination = self.path(remote)
+
+        def transfer(name):
+            # like rclone move, the source is deleted as soon as its copy succeeds
+            try:
+                if not self.copy(os.path.join(source, name), os.path.join(destination, name), name):
+                    return False
+                os.remove(os.path.join(source, name))
+                logger.info("%s: Deleted", name)
+                return True
+            except Exception as ex:
+                logger.error("%s: Failed to copy: %s", name, ex)
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, transfers)) as executor:
+            moved = [name for name, done in zip(files, executor.map(transfer, files)) if done]
+        return 0 if len(moved) == len(files) or self.dry_run else 1
+
+    def delete(self, remote):
+        if not self.request():
+            logger.error("%s: Failed to delete: %s", remote, rate_limit_message)
+            return 1
+        path = self.path(remote)
+        if not os.path.isfile(path):
+            logger.error("%s: Failed to delete: object not found", remote)
+            return 1
+        if self.dry_run:
+            logger.info("%s: Not deleting as --dry-run", remote)
+            return 0
+        os.remove(path)
+        logger.info("%s: Deleted", remote)
+        return 0
+
+
+def exclude_regex(pattern):
+    # rclone filter glob: ** / * / ? / [class] / {a,b} / \ escapes, a leading / anchors it to the root
+    anchored = pattern.startswith('/')
+    if anchored:
+        pattern = pattern[1:]
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex += '[' + chars.replace('\\', '\\\\') + ']'
+            i = end
+        elif char == '{' and pattern.find('}', i) != -1:
+            end = pattern.find('}', i)
+            regex += '(' + '|'.join(re.escape(item) for item in pattern[i + 1:end].split(',')) + ')'
+            i = end
+        else:
+            regex += re.escape(char)
+        i += 1
+    return re.compile(('^' if anchored else '(^|/)') + regex + '$')
+
+
+def excluded(path, excludes):
+    for exclude in excludes:
+        if exclude.endswith('/'):
+            # directory pattern, excludes everything below a matching directory
+            regex = exclude_regex(exclude[:-1])
+            parts = path.split('/')[:-1]
+            if any(regex.search('/'.join(parts[:depth])) for depth in range(1, len(parts) + 1)):
+                return True
+        elif exclude_regex(exclude).search(path):
+            return True
+    return False
+
+
+def source_files(source, files_from, excludes):
+    if files_from:
+        with open(files_from, 'r') as fp:
+            files = [line.rstrip('\n') for line in fp if line.strip()]
+            fp.close()
+        return [name for name in files if os.path.isfile(os.path.join(source, name))]
+
+    files = []
+    for path, subdirs, names in os.walk(source):
+        for name in names:
+            relative = os.path.relpath(os.path.join(path, name), source)
+            if not excluded(relative, excludes):
+                files.append(relative)
+    return sorted(files)
+
+
+def main(argv):
+    args = []
+    flags = {}
+    excludes = []
+    for item in argv:
+        if not item.startswith('-'):
+            args.append(item)
+            continue
+        name, _, value = item.lstrip('-').partition('=')
+        if name == 'exclude':
+            excludes.append(value)
+        else:
+            flags[name] = value
+
+    if 'root' not in flags or not len(args):
+        logger.error("Usage: standin.py --root=FOLDER [--latency=SECONDS] [--bandwidth=SIZE] "
+                     "[--rate-limit-every=N] move SOURCE REMOTE | delete REMOTE | lsf SOURCE")
+        return 2
+
+    # the emulated link speed caps the transfer as well as any --bwlimit rclone was given
+    limits = [utils.bwlimit_bytes_per_second(flags.get(name, '')) for name in ('bandwidth', 'bwlimit')]
+    limits = [limit for limit in limits if limit]
+    standin = Standin(flags['root'], float(flags.get('latency') or 0), min(limits) if limits else None,
+                      int(flags.get('rate-limit-every') or 0), 'dry-run' in flags)
+
+    if args[0] == 'lsf' and len(args) == 2:
+        # lists the local source, so it is not subject to latency or rate limits
+        for name in source_files(args[1], None, excludes):
+            print(name)
+        return 0
+    if args[0] == 'move' and len(args) == 3:
+        files = source_files(args[1], flags.get('files-from'), excludes)
+        return standin.move(args[1], args[2], files, int(flags.get('transfers') or 4))
+    if args[0] == 'delete' and len(args) == 2:
+        return standin.delete(args[1])
+
+    logger.error("Unsupported command: %r", args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,11 +1,17 @@
+import fcntl
 import http.client
 import json
 import logging
 import os
+import re
 import shlex
+import signal
 import subprocess
 import sys
+import tempfile
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from urllib import parse
 
 try:
@@ -17,6 +23,8 @@ logger = logging.getLogger("UTILS")
 logger.setLevel(logging.DEBUG)
 
 rate_limits_seen = 0
+current_process = None
+draining = False
 
 
 ############################################################
@@ -50,16 +58,20 @@ def get_num(x):
     return int(''.join(ele for ele in x if ele.isdigit() or ele == '.'))
 
 
-def run_command(command, cfg=None):
-    global rate_limits_seen
+def run_command(command, cfg=None, journal=False):
+    global rate_limits_seen, current_process
 
     process = subprocess.Popen(shlex.split(command), shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    current_process = process
     while True:
-        output = str(process.stdout.readline()).lstrip('b').replace('\\n', '')
-        if process.poll() is not None:
+        line = process.stdout.readline()
+        if not line and process.poll() is not None:
             break
+        output = line.decode('utf-8', 'replace').rstrip('\n')
         if output and len(output) > 6:
             logger.info(output)
+            if journal:
+                journal_output(output)
             if cfg and 'Error 403: User rate limit exceeded' in output:
                 if rate_limits_seen <= 4:
                     rate_limits_seen += 1
@@ -77,10 +89,33 @@ def run_command(command, cfg=None):
                                       "check_interval has been set to %d minutes." %
                                       cfg['local_folder_check_interval'])
 
-    rc = process.poll()
+    rc = process.wait()
+    current_process = None
     return rc
 
 
+def drain_command(timeout):
+    # let the running command finish on its own, terminating it if it is still running after timeout seconds
+    global draining
+
+    if draining:
+        # already draining, don't push the deadline back
+        return True
+    if current_process is None or current_process.poll() is not None:
+        return False
+    draining = True
+    logger.info("Waiting up to %d seconds for the running command to finish...", timeout)
+    signal.signal(signal.SIGALRM, terminate_command)
+    signal.alarm(max(1, timeout))
+    return True
+
+
+def terminate_command(signum=None, frame=None):
+    if current_process is not None and current_process.poll() is None:
+        logger.info("Terminating command %r", current_process.pid)
+        current_process.terminate()
+
+
 def folder_size(path, excludes):
     try:
         process = os.popen(du_size_command(path, excludes))
@@ -94,11 +129,13 @@ def folder_size(path, excludes):
         return None
 
 
-def rclone_delete(path, dry_run):
+def rclone_delete(path, dry_run, binary='rclone'):
     try:
-        cmd = 'rclone delete %s --drive-use-trash' % cmd_quote(path)
+        cmd = '%s delete %s --drive-use-trash' % (binary, cmd_quote(path))
         if dry_run:
             cmd += ' --dry-run'
+        # rclone logs to stderr
+        cmd += ' 2>&1'
         process = os.popen(cmd)
         data = process.read()
         process.close()
@@ -172,8 +209,9 @@ def send_notification(config, message):
         send_slack(config['slack_webhook_url'], message)
 
 
-def rclone_move_command(local, remote, transfers, checkers, bwlimit, excludes, chunk_size, dry_run):
-    upload_cmd = 'rclone move %s %s' \
+def rclone_move_command(local, remote, transfers, checkers, bwlimit, excludes, chunk_size, dry_run, files_from=None,
+                        binary='rclone'):
+    upload_cmd = '%s move %s %s' \
                  ' --delete-after' \
                  ' --no-traverse' \
                  ' --stats=60s' \
@@ -181,16 +219,27 @@ def rclone_move_command(local, remote, transfers, checkers, bwlimit, excludes, c
                  ' --transfers=%d' \
                  ' --checkers=%d' \
                  ' --drive-chunk-size=%s' % \
-                 (cmd_quote(local), cmd_quote(remote), transfers, checkers, chunk_size)
+                 (binary, cmd_quote(local), cmd_quote(remote), transfers, checkers, chunk_size)
     if bwlimit and len(bwlimit):
         upload_cmd += ' --bwlimit="%s"' % bwlimit
-    for item in excludes:
-        upload_cmd += ' --exclude="%s"' % item
+    if files_from:
+        # the file list was already filtered against excludes when it was planned
+        upload_cmd += ' --files-from=%s' % cmd_quote(files_from)
+    else:
+        for item in excludes:
+            upload_cmd += ' --exclude="%s"' % item
     if dry_run:
         upload_cmd += ' --dry-run'
     return upload_cmd
 
 
+def rclone_lsf_command(path, excludes, binary='rclone'):
+    lsf_cmd = '%s lsf -R --files-only %s' % (binary, cmd_quote(path))
+    for item in excludes:
+        lsf_cmd += ' --exclude="%s"' % item
+    return lsf_cmd
+
+
 def du_size_command(path, excludes):
     size_cmd = "du -s --block-size=1G"
     for item in excludes:
@@ -199,6 +248,17 @@ def du_size_command(path, excludes):
     return size_cmd
 
 
+def rclone_binary(config):
+    if config['remote_backend'] != 'standin':
+        return 'rclone'
+
+    # the standin backend uses a local folder as the remote, see standin.py
+    standin = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standin.py')
+    return '%s %s --root=%s --latency=%s --bandwidth=%s --rate-limit-every=%d' % \
+           (cmd_quote(sys.executable), cmd_quote(standin), cmd_quote(config['standin_folder']),
+            config['standin_latency'], cmd_quote(config['standin_bwlimit']), config['standin_rate_limit_every'])
+
+
 def read_file_text(file):
     data = ""
     try:
@@ -230,6 +290,484 @@ def remove_empty_directories(config, force_dry_run=False):
                      open_files)
 
 
+############################################################
+# PLAN STUFF
+############################################################
+
+plan_version = 1
+
+
+def rclone_size_to_bytes(size):
+    # rclone sizes default to KiB when no suffix is given, e.g. 512 / 512k / 8M / 1G
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([bkmgt]?)\s*$', size, re.IGNORECASE)
+    if not match:
+        return None
+    multiplier = {'b': 1, '': 1024, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    return int(float(match.group(1)) * multiplier[match.group(2).lower()])
+
+
+def bwlimit_bytes_per_second(bwlimit):
+    # timetables (e.g. "08:00,512 23:00,off") cannot be reduced to a single rate, treat them as unknown
+    if not bwlimit or not len(bwlimit) or bwlimit.strip().lower() == 'off':
+        return None
+    if ' ' in bwlimit.strip() or ',' in bwlimit:
+        return None
+    return rclone_size_to_bytes(bwlimit)
+
+
+def scan_hidden(config):
+    remote_deletes = []
+    hidden_removals = []
+
+    hidden_files = []
+    for path, subdirs, files in os.walk(config['unionfs_folder']):
+        for name in files:
+            if name.endswith('_HIDDEN~'):
+                hidden_files.append(os.path.join(path, name))
+
+    # cloud_folder is usually a fuse mount, so check the hidden files against it concurrently
+    def check_cloud(file):
+        relative = os.path.relpath(file, config['unionfs_folder'])[:-len('_HIDDEN~')]
+        cloud_path = os.path.join(config['cloud_folder'], relative)
+        remote_path = config['remote_folder'].rstrip('/') + '/' + relative
+        return file, remote_path, os.path.exists(cloud_path)
+
+    with ThreadPoolExecutor(max_workers=max(1, config['rclone_checkers'])) as executor:
+        for file, remote_path, exists in executor.map(check_cloud, hidden_files):
+            if exists:
+                remote_deletes.append({'hidden': file, 'remote': remote_path})
+            else:
+                hidden_removals.append(file)
+
+    return remote_deletes, hidden_removals
+
+
+def rclone_files(path, excludes, binary='rclone'):
+    # let rclone apply the excludes, so the files listed are exactly the ones rclone move would pick
+    cmd = rclone_lsf_command(path, excludes, binary)
+    process = subprocess.Popen(shlex.split(cmd), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    data, error = process.communicate()
+    if process.returncode:
+        raise RuntimeError("Listing %r failed with exit code %d: %s" %
+                           (path, process.returncode, error.decode('utf-8', 'replace').strip()))
+    return set(item for item in data.decode('utf-8', 'replace').split('\n') if item)
+
+
+def scan_local(folder, included=None):
+    # walk bottom-up so we know which directories will be left empty once their files are moved
+    uploads = []
+    remaining = {}
+    for path, subdirs, files in os.walk(folder, topdown=False):
+        keep = False
+        for name in files:
+            file = os.path.join(path, name)
+            relative = os.path.relpath(file, folder)
+            if included is None or relative not in included:
+                keep = True
+                continue
+            try:
+                stat = os.lstat(file)
+                uploads.append({'path': relative, 'size': stat.st_size, 'mtime': stat.st_mtime})
+            except OSError:
+                logger.exception("Exception retrieving size of %r: ", file)
+                keep = True
+        for name in subdirs:
+            if remaining.get(os.path.join(path, name), True):
+                keep = True
+        remaining[path] = keep
+    return uploads, remaining
+
+
+def scan_prune(config, remaining):
+    prune = []
+    for folder, depth in config['rclone_remove_empty_on_upload'].items():
+        if not os.path.exists(folder):
+            continue
+        folder = os.path.normpath(folder)
+        if not (folder + os.sep).startswith(os.path.normpath(config['local_folder']) + os.sep):
+            # not part of the upload, nothing in here gets moved
+            folder_remaining = scan_local(folder)[1]
+        else:
+            folder_remaining = remaining
+        for path, keep in folder_remaining.items():
+            if keep or not (path + os.sep).startswith(folder + os.sep):
+                continue
+            relative = os.path.relpath(path, folder)
+            if relative != '.' and len(relative.split(os.sep)) >= depth:
+                prune.append(path)
+    return sorted(set(prune), key=lambda item: (-item.count(os.sep), item))
+
+
+def plan_upload(config):
+    included = rclone_files(config['local_folder'], config['rclone_excludes'], rclone_binary(config))
+    uploads, remaining = scan_local(config['local_folder'], included)
+    uploads.sort(key=lambda item: item['path'])
+
+    total_bytes = sum(item['size'] for item in uploads)
+    bytes_per_second = bwlimit_bytes_per_second(config['rclone_bwlimit'])
+
+    upload = {
+        'source': config['local_folder'],
+        'destination': config['local_remote'],
+        'bwlimit': config['rclone_bwlimit'],
+        'files': uploads,
+        'total_bytes': total_bytes,
+        'estimated_seconds': int(total_bytes / bytes_per_second) if bytes_per_second else None,
+    }
+    return upload, remaining
+
+
+def build_plan(config):
+    remote_deletes, hidden_removals = scan_hidden(config)
+    upload, remaining = plan_upload(config)
+
+    return {
+        'version': plan_version,
+        'dry_run': config['dry_run'],
+        'remote_deletes': sorted(remote_deletes, key=lambda item: item['hidden']),
+        'hidden_removals': sorted(hidden_removals),
+        'upload': upload,
+        'prune_directories': scan_prune(config, remaining),
+    }
+
+
+def log_plan(plan):
+    for item in plan['remote_deletes']:
+        logger.debug("Would delete %r (hidden by %r)", item['remote'], item['hidden'])
+    for file in plan['hidden_removals']:
+        logger.debug("Would remove %r, it does not exist on remote", file)
+    upload = plan['upload']
+    logger.debug("Would move %d file(s) totalling %d bytes from %r to %r", len(upload['files']),
+                 upload['total_bytes'], upload['source'], upload['destination'])
+    if upload['estimated_seconds'] is not None:
+        logger.debug("Estimated transfer time at bwlimit %r: %s", upload['bwlimit'],
+                     seconds_to_string(upload['estimated_seconds']) or '0 seconds')
+    else:
+        logger.debug("No fixed bwlimit set, unable to estimate transfer time")
+    for path in plan['prune_directories']:
+        logger.debug("Would remove empty directory %r", path)
+
+
+def write_plan(plan, file=None):
+    data = json.dumps(plan, indent=4, sort_keys=True)
+    if file is None:
+        print(data)
+        return
+    with open(file, 'w') as fp:
+        fp.write(data + '\n')
+        fp.close()
+    logger.debug("Wrote plan to %r", file)
+
+
+def load_plan(file):
+    with open(file, 'r') as fp:
+        plan = json.load(fp)
+        fp.close()
+    if plan.get('version') != plan_version:
+        raise ValueError("Unsupported plan version %r in %r" % (plan.get('version'), file))
+    logger.debug("Loaded plan %r", file)
+    return plan
+
+
+def execute_hidden(plan, config, dry_run):
+    deleted = 0
+    failed = 0
+    binary = rclone_binary(config)
+    for item in plan['remote_deletes']:
+        # the remote file may have been replaced since the plan was made, only delete while still hidden
+        if not os.path.exists(item['hidden']):
+            logger.debug("Skipped removing %r, %r no longer exists", item['remote'], item['hidden'])
+            continue
+        logger.debug("Removing %r", item['remote'])
+        if rclone_delete(item['remote'], dry_run, binary):
+            deleted += 1
+            logger.debug("Deleted %r", item['remote'])
+            if not dry_run:
+                try:
+                    os.remove(item['hidden'])
+                except Exception as ex:
+                    logger.exception("Exception removing _HIDDEN~ file %s: ", item['hidden'])
+        else:
+            failed += 1
+            logger.debug("Failed to delete %r", item['remote'])
+
+    for file in plan['hidden_removals']:
+        if not os.path.exists(file):
+            logger.debug("Skipped removing %r, it no longer exists", file)
+            continue
+        logger.debug("File does not exist on remote, removing %r", file)
+        if not dry_run:
+            try:
+                os.remove(file)
+            except Exception as ex:
+                logger.exception("Exception removing _HIDDEN~ file %s: ", file)
+
+    return deleted, failed
+
+
+def execute_upload(upload, config, dry_run):
+    if not len(upload['files']):
+        logger.debug("No files to upload")
+        return None
+
+    # journal the batch before starting so an interrupted upload can be resumed, see resume_upload()
+    journal = not dry_run
+    locked = False
+    if journal:
+        if upload_lock is None:
+            if not lock_journal():
+                logger.info("Skipped upload, another upload is using %r", journal_path)
+                return 1
+            locked = True
+        journal_start(upload)
+
+    fd, files_from = tempfile.mkstemp(prefix='unionfs_cleaner_', suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            for item in upload['files']:
+                fp.write(item['path'] + '\n')
+        upload_cmd = rclone_move_command(upload['source'], upload['destination'], config['rclone_transfers'],
+                                         config['rclone_checkers'], upload['bwlimit'], config['rclone_excludes'],
+                                         config['rclone_chunk_size'], dry_run, files_from, rclone_binary(config))
+        logger.debug("Using: %r", upload_cmd)
+        rc = run_command(upload_cmd, config, journal)
+
+        # keep the journal around when we were stopped midway, the remainder is picked up on the next start
+        if journal and rc == 0 and not draining:
+            journal_clear()
+    finally:
+        os.remove(files_from)
+        if locked:
+            unlock_journal()
+    return rc
+
+
+def execute_prune(plan, dry_run):
+    for path in plan['prune_directories']:
+        if dry_run:
+            logger.debug("Would have removed empty directory %r", path)
+            continue
+        try:
+            os.rmdir(path)
+            logger.debug("Removed empty directory %r", path)
+        except OSError:
+            logger.debug("Skipped removing %r, it is missing or no longer empty", path)
+
+
+def execute_plan(plan, config):
+    dry_run = plan['dry_run']
+    if not dry_run and os.path.exists(journal_path):
+        logger.error("Refusing to execute the plan, %r exists so an upload is running or waiting to be resumed",
+                     journal_path)
+        return False
+    logger.debug("Executing plan with dry_run %r", dry_run)
+    start_time = time.time()
+    deleted, failed = execute_hidden(plan, config, dry_run)
+    logger.debug("Deleted %d of %d planned file(s) off remote", deleted, len(plan['remote_deletes']))
+
+    open_files = opened_files(plan['upload']['source'], config['lsof_excludes'])
+    if open_files:
+        logger.debug("Skipped upload and directory removal because %d files are currently open: %r",
+                     len(open_files), open_files)
+        return False
+
+    # only files that are there before the upload and gone after it were moved by it
+    source = plan['upload']['source']
+    present = [item for item in plan['upload']['files'] if os.path.exists(os.path.join(source, item['path']))]
+
+    upload_time = time.time()
+    rc = execute_upload(plan['upload'], config, dry_run)
+    if draining:
+        return False
+    upload_time = time.time() - upload_time
+    execute_prune(plan, dry_run)
+
+    taken = seconds_to_string(time.time() - start_time) or '0 seconds'
+    if dry_run:
+        logger.debug("Executed dry run plan in %s, nothing was moved", taken)
+    else:
+        moved = [item for item in present if not os.path.exists(os.path.join(source, item['path']))]
+        moved_bytes = sum(item['size'] for item in moved)
+        logger.debug("Executed plan in %s, moved %d of %d file(s), %d of %d bytes at %d bytes/s", taken,
+                     len(moved), len(plan['upload']['files']), moved_bytes, plan['upload']['total_bytes'],
+                     moved_bytes / max(upload_time, 0.001))
+
+    if failed:
+        logger.error("Failed to delete %d planned file(s) off remote", failed)
+        return False
+    if rc:
+        logger.error("Upload failed with exit code %r", rc)
+        return False
+    return True
+
+
+############################################################
+# JOURNAL STUFF
+############################################################
+
+journal_path = os.path.join(os.path.dirname(sys.argv[0]), 'upload.journal')
+upload_lock = None
+
+# rclone -v log lines, e.g. "2017/08/01 12:00:00 INFO  : Movies/A/A.mkv: Copied (new)"
+journal_regex = re.compile(r'INFO\s*:\s*(?P<path>.+): (?P<event>Copied|Moved|Deleted)\b')
+
+
+def lock_journal():
+    # only one process (the upload manager or a plan execution) may use the journal at a time
+    global upload_lock
+
+    fp = open(journal_path + '.lock', 'a')
+    try:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fp.close()
+        return False
+    upload_lock = fp
+    return True
+
+
+def unlock_journal():
+    global upload_lock
+
+    if upload_lock is not None:
+        upload_lock.close()
+        upload_lock = None
+
+
+def journal_write(entry, mode='a', file=None):
+    with open(file or journal_path, mode) as fp:
+        fp.write(json.dumps(entry, sort_keys=True) + '\n')
+        fp.flush()
+        os.fsync(fp.fileno())
+        fp.close()
+
+
+def journal_start(upload):
+    # write the manifest to a temporary file first so the journal is never left half written
+    temp_path = journal_path + '.tmp'
+    journal_write({'manifest': upload}, 'w', temp_path)
+    os.replace(temp_path, journal_path)
+    logger.debug("Journaled upload of %d file(s) to %r", len(upload['files']), journal_path)
+
+
+def journal_output(output):
+    match = journal_regex.search(output)
+    if not match:
+        return
+    try:
+        journal_write({match.group('event').lower(): match.group('path')})
+    except Exception as ex:
+        logger.exception("Exception writing to journal %r: ", journal_path)
+
+
+def journal_load():
+    manifest = None
+    events = {}
+    if not os.path.exists(journal_path):
+        return manifest, events
+
+    with open(journal_path, 'r') as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # last line may have been cut short by a crash
+                continue
+            if 'manifest' in entry:
+                manifest = entry['manifest']
+                continue
+            for event, path in entry.items():
+                events.setdefault(path, set()).add(event)
+        fp.close()
+    return manifest, events
+
+
+def journal_clear():
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+        logger.debug("Cleared journal %r", journal_path)
+
+
+def remove_copied(source, copied):
+    # rclone copied these but was stopped before deleting the source, so only the delete is left to do
+    removed = 0
+    for item in copied:
+        file = os.path.join(source, item['path'])
+        try:
+            os.remove(file)
+            journal_write({'deleted': item['path']})
+            removed += 1
+            logger.debug("Removed %r, it was already copied", file)
+        except Exception as ex:
+            logger.exception("Exception removing copied file %r: ", file)
+    return removed
+
+
+def resume_upload(config):
+    if not lock_journal():
+        logger.debug("Skipped resuming, another upload is using %r", journal_path)
+        return None
+    try:
+        return resume_journal(config)
+    finally:
+        unlock_journal()
+
+
+def resume_journal(config):
+    try:
+        manifest, events = journal_load()
+    except Exception as ex:
+        logger.exception("Exception reading journal %r: ", journal_path)
+        return None
+    if manifest is None:
+        journal_clear()
+        return None
+
+    # moved or deleted files are finished, copied files only need their source removing, the rest is resubmitted
+    remainder = []
+    copied = []
+    for item in manifest['files']:
+        done = events.get(item['path'], set())
+        if 'moved' in done or 'deleted' in done:
+            continue
+        file = os.path.join(manifest['source'], item['path'])
+        if not os.path.exists(file):
+            continue
+        # a file rewritten since it was copied must be uploaded again, even if its size is unchanged
+        stat = os.stat(file)
+        if 'copied' in done and stat.st_size == item['size'] and stat.st_mtime == item.get('mtime'):
+            copied.append(item)
+        else:
+            remainder.append(item)
+
+    logger.info("Found an interrupted upload of %d file(s), %d left to upload and %d already copied",
+                len(manifest['files']), len(remainder), len(copied))
+    if not len(remainder) and not len(copied):
+        journal_clear()
+        return None
+
+    if config['dry_run']:
+        logger.warning("Not resuming the interrupted upload in %r while dry_run is enabled", journal_path)
+        return None
+
+    open_files = opened_files(manifest['source'], config['lsof_excludes'])
+    if open_files:
+        logger.debug("Postponed resuming the upload because %d files are currently open: %r", len(open_files),
+                     open_files)
+        return None
+
+    if len(copied):
+        remove_copied(manifest['source'], copied)
+    if not len(remainder):
+        journal_clear()
+        return 0
+
+    upload = dict(manifest)
+    upload['files'] = remainder
+    upload['total_bytes'] = sum(item['size'] for item in remainder)
+    return execute_upload(upload, config, False)
+
+
 ############################################################
 # CONFIG STUFF
 ############################################################
@@ -274,6 +812,12 @@ base_config = {
     'use_config_manager': False,  # whether or not to start the config manager, restart script on config change
     'use_upload_manager': False,  # whether or not to start the upload manager upon script start
     'use_git_autoupdater': False,  # whether to automatically update (git pull) when theres a new commit on script start
+    'remote_backend': 'rclone',  # 'rclone', or 'standin' to use standin_folder as the remote for offline testing
+    'standin_folder': '/tmp/unionfs_cleaner_remote',  # folder the standin backend stores remote files in
+    'standin_latency': 0,  # seconds every standin request takes
+    'standin_bwlimit': '',  # bandwidth of the standin backend, e.g. 10M, leave empty for no limit
+    'standin_rate_limit_every': 0,  # standin returns Error 403 rate limit on every Nth request, 0 to disable
+    'upload_drain_seconds': 60,  # seconds to let a running upload finish on shutdown/restart before stopping it
     'dry_run': True,  # whether or not to use dry-run with rclone so no files are deleted/moved. use to verify working.
 }
 
@@ -320,34 +864,16 @@ def build_config():
 
 
 def config_test(config):
-    # test parse .unionfs folder
-    logger.debug("Testing unionfs_folder, cloud_folder and remote_folder")
-    tested_hidden = False
-    for path, subdirs, files in os.walk(config['unionfs_folder']):
-        for name in files:
-            file = os.path.join(path, name)
-            if file and file.endswith('_HIDDEN~'):
-                logger.debug("Hidden file detected: %r", file)
-                cloud_path = file.replace(config['unionfs_folder'], config['cloud_folder']).rstrip('_HIDDEN~')
-                remote_path = file.replace(config['unionfs_folder'], config['remote_folder']).rstrip('_HIDDEN~')
-                logger.debug('Check exists on cloud_folder: %r', cloud_path)
-                if os.path.exists(cloud_path):
-                    tested_hidden = True
-                    logger.debug('Exists! I would have ran when this file was created:\nrclone delete %r', remote_path)
-    if not tested_hidden:
+    logger.debug("Testing unionfs_folder, cloud_folder, remote_folder, local_folder, local_remote, "
+                 "rclone_excludes, rclone_bwlimit and rclone_remove_empty_on_upload")
+    plan = build_plan(config)
+    if not len(plan['remote_deletes']):
         logger.debug("Did not find a _HIDDEN~ file on your cloud_folder, please upgrade a file then check me again!")
+    log_plan(plan)
 
     # show example rclone move that would have been used
-    size = folder_size(config['local_folder'], config['du_excludes'])
-    logger.debug("Local folder size is %d gigabytes", size)
-    logger.debug("Testing local_folder, local_remote, rclone_transfers, rclone_checkers, rclone_excludes and dry_run")
     upload_cmd = rclone_move_command(config['local_folder'], config['local_remote'], config['rclone_transfers'],
                                      config['rclone_checkers'], config['rclone_bwlimit'], config['rclone_excludes'],
-                                     config['rclone_chunk_size'], config['dry_run'])
+                                     config['rclone_chunk_size'], config['dry_run'], binary=rclone_binary(config))
     logger.debug("Rclone move command, I would have ran:\n%r", upload_cmd)
-
-    # show example of folders that would have been removed after upload
-    logger.debug("I would have removed the following folders after the rclone move:")
-    remove_empty_directories(config, True)
-
-    exit(0)
+    return plan